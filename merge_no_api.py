@@ -8,7 +8,10 @@ Inputs:
   --opps opps.csv             # Salesforce export (must include Account.Name; optional channel_id field)
   --metrics tubular.csv       # Tubular CSV export with channel_id + metrics columns
   --map channel_map.csv       # OPTIONAL: map Account.Name -> channel_id if opps has no channel_id
-  --out merged.csv            # Output file
+  --out merged.csv            # Output file (use a .parquet extension for Parquet output)
+  --opps-cols Id,Name,Amount   # OPTIONAL: only carry these opps columns into the output
+  --chunksize 200000          # OPTIONAL: opps rows per batch for CSV output (0 = whole file)
+  --no-cache                  # OPTIONAL: skip the per-user Feather cache of parsed inputs
 
 Expected columns:
   opps.csv:
@@ -29,10 +32,26 @@ Advanced:
     --metrics-cols channel_id:Channel ID,views_30d:Views (30d),audience_size:Subscribers
 """
 import argparse
+import csv
+import functools
+import hashlib
+import io
+import os
 import sys
-from typing import Dict, Optional
+from pathlib import Path
+from types import MappingProxyType
+from typing import IO, AbstractSet, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+DEFAULT_CHUNKSIZE = 200_000
+CHANNEL_COLUMN_CANDIDATES = ("Account.YouTube_Channel_ID__c", "YouTube_Channel_ID__c", "channel_id", "Channel_ID__c")
+ACCOUNT_COLUMN_CANDIDATES = ("Account.Name", "account_name", "Account")
 
 
 def parse_colmap(arg: str) -> Dict[str, str]:
@@ -48,33 +67,391 @@ def parse_colmap(arg: str) -> Dict[str, str]:
     return mapping
 
 
-def _find_channel_column(opps: pd.DataFrame) -> Optional[str]:
-    for col in ["Account.YouTube_Channel_ID__c", "YouTube_Channel_ID__c", "channel_id", "Channel_ID__c"]:
-        if col in opps.columns:
+@functools.lru_cache(maxsize=32)
+def parse_metrics_renames(arg: str) -> Mapping[str, str]:
+    """Parse ``new:old,new:old`` into a read-only ``{old: new}`` rename mapping.
+
+    This is ``parse_colmap`` inverted, ready to pass to ``DataFrame.rename``
+    and to ``merge_data(metrics_renames=...)``. It is cached per argument
+    string, so repeated calls with the same text are free.
+    """
+
+    return MappingProxyType({old: new for new, old in parse_colmap(arg).items()})
+
+
+def _cache_prefix(path: str, text_columns: Sequence[str] = ()) -> str:
+    """File name prefix shared by every cached version of ``path``."""
+
+    source = hashlib.sha1(f"{os.path.abspath(path)}:{','.join(text_columns)}".encode()).hexdigest()
+    return f"merge_cache_{source}_"
+
+
+def _cache_dir() -> Optional[Path]:
+    """Per-user cache directory, or ``None`` if it can't be kept private.
+
+    It lives under ``$XDG_CACHE_HOME`` (``~/.cache`` by default) with mode
+    0700 rather than in the shared temp dir, so other local users can neither
+    read the cached exports nor plant files under the expected names.
+    """
+
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    cache_dir = Path(base) / "sf-tubular-merge"
+    try:
+        cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        stat = cache_dir.stat()
+    except OSError:
+        return None
+    if hasattr(os, "getuid") and (stat.st_uid != os.getuid() or stat.st_mode & 0o077):
+        return None
+    return cache_dir
+
+
+def _cache_path(path: str, text_columns: Sequence[str] = ()) -> Optional[Path]:
+    """Location of the Feather copy of ``path``; any edit to the CSV changes the key."""
+
+    cache_dir = _cache_dir()
+    if cache_dir is None:
+        return None
+    stat = os.stat(path)
+    version = hashlib.sha1(f"{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+    return cache_dir / f"{_cache_prefix(path, text_columns)}{version}.feather"
+
+
+def _read_cached_table(path: str, text_columns: Sequence[str] = ()) -> pa.Table:
+    """Read ``path`` from its Feather cache, parsing and caching the full CSV on a miss.
+
+    The copy is LZ4-compressed Feather (``write_feather``'s default), so a hit
+    still decompresses the whole table, and callers convert all of it to
+    pandas; it only saves the CSV parse. Writing a new copy removes the copies
+    of earlier versions of the same file, so the cache directory holds at
+    most one per input.
+    """
+
+    cache = _cache_path(path, text_columns)
+    if cache is None:
+        return _read_table(path, text_columns)
+    if not cache.exists():
+        table = _read_table(path, text_columns)
+        tmp = cache.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            feather.write_feather(table, tmp)
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, cache)
+            for stale in cache.parent.glob(f"{_cache_prefix(path, text_columns)}*.feather"):
+                if stale != cache:
+                    stale.unlink(missing_ok=True)
+        except OSError:
+            # A read-only cache dir only costs the speed-up, not the run.
+            tmp.unlink(missing_ok=True)
+            return table
+    return feather.read_table(cache, memory_map=True)
+
+
+def _dedupe_headers(names: Iterable[str]) -> List[str]:
+    """Suffix repeated headers as ``name.1``, ``name.2`` ... the way ``pd.read_csv`` does."""
+
+    seen = set()
+    counts: Dict[str, int] = {}
+    deduped = []
+    for name in names:
+        new = name
+        while new in seen:
+            counts[name] = counts.get(name, 0) + 1
+            new = f"{name}.{counts[name]}"
+        seen.add(new)
+        deduped.append(new)
+    return deduped
+
+
+def _is_short_row_error(exc: pa.ArrowInvalid) -> bool:
+    # Arrow's CSV parser rejects rows whose field count differs from the header.
+    return "columns, got" in str(exc)
+
+
+def _read_table(source: Union[str, IO[bytes]], text_columns: Sequence[str] = ()) -> pa.Table:
+    if isinstance(source, str) and not os.path.isfile(source):
+        # Arrow seeks on paths it opens itself, which fails for pipes. Buffer
+        # the pipe instead, so the short-row fallback below can re-read it.
+        with open(source, "rb") as handle:
+            return _read_table(io.BytesIO(handle.read()), text_columns)
+    start = None if isinstance(source, str) else source.tell()
+    read_options = pacsv.ReadOptions(use_threads=True)
+    # Empty fields become nulls, matching pd.read_csv.
+    convert_options = pacsv.ConvertOptions(
+        column_types=dict.fromkeys(text_columns, pa.string()),
+        strings_can_be_null=True,
+    )
+    try:
+        table = pacsv.read_csv(source, read_options=read_options, convert_options=convert_options)
+    except pa.ArrowInvalid as exc:
+        if "Empty CSV" in str(exc):
+            raise pd.errors.EmptyDataError(str(exc)) from exc
+        if not _is_short_row_error(exc):
+            raise
+        # Arrow rejects rows with missing trailing fields; pd.read_csv pads
+        # them with nulls, so the file is read with pandas instead.
+        if start is not None:
+            source.seek(start)
+        text_dtype = pd.ArrowDtype(pa.string())
+        frame = pd.read_csv(source, dtype=dict.fromkeys(text_columns, text_dtype), dtype_backend="pyarrow")
+        return pa.Table.from_pandas(frame, preserve_index=False)
+    return table.rename_columns(_dedupe_headers(table.column_names))
+
+
+def read_csv(
+    source: Union[str, IO[bytes]], use_cache: bool = False, text_columns: Sequence[str] = ()
+) -> pd.DataFrame:
+    """Parse a CSV with Arrow's multi-threaded reader into Arrow-backed columns.
+
+    ``text_columns`` are kept as strings instead of being type-inferred, for
+    key columns that have to match text read elsewhere.
+    ``use_cache`` keeps a Feather copy of a regular file's parsed contents in
+    a private per-user cache directory, keyed on the file's path, size and
+    mtime, so repeated runs on
+    the same inputs skip CSV parsing. Raises ``pd.errors.EmptyDataError`` for
+    empty input so callers can keep handling it the same way as with
+    ``pd.read_csv``.
+    """
+
+    if use_cache and isinstance(source, str) and os.path.isfile(source):
+        table = _read_cached_table(source, text_columns)
+    else:
+        table = _read_table(source, text_columns)
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def _open_text_csv(handle: IO[bytes], columns: Optional[Iterable[str]] = None) -> pa.RecordBatchReader:
+    """Start a streaming read of ``handle`` with every column kept as text.
+
+    The header line is read from ``handle`` itself, so a pipe or other
+    non-seekable source works. Text columns are never re-inferred, so a later
+    block cannot disagree with the first one and values are written back out
+    exactly as they were read, whatever the batch size. Parse errors surface
+    while iterating, not here.
+    """
+
+    header_line = handle.readline()
+    if not header_line.strip():
+        raise pd.errors.EmptyDataError("No columns to parse from file")
+    header = _dedupe_headers(next(csv.reader([header_line.decode("utf-8-sig")])))
+    include_columns = header
+    if columns is not None:
+        wanted = set(columns)
+        include_columns = [c for c in header if c in wanted]
+    column_types = dict.fromkeys(include_columns, pa.string())
+
+    def batches() -> Iterator[pa.RecordBatch]:
+        try:
+            reader = pacsv.open_csv(
+                handle,
+                read_options=pacsv.ReadOptions(use_threads=True, column_names=header),
+                convert_options=pacsv.ConvertOptions(
+                    column_types=column_types,
+                    include_columns=include_columns,
+                    strings_can_be_null=True,
+                ),
+            )
+        except pa.ArrowInvalid as exc:
+            # Header only: no rows, but the columns still carry through to the output.
+            if "Empty CSV" in str(exc):
+                return
+            raise
+        yield from reader
+
+    return pa.RecordBatchReader.from_batches(pa.schema(column_types), batches())
+
+
+def _iter_arrow_frames(reader: pa.RecordBatchReader, chunksize: int) -> Iterator[pd.DataFrame]:
+    if chunksize <= 0:
+        table = reader.read_all()
+        if not table.num_rows:
+            # A table built from no batches has no chunks at all, which
+            # pandas' join can't factorize; an empty table has one empty chunk.
+            table = reader.schema.empty_table()
+        yield table.to_pandas(types_mapper=pd.ArrowDtype)
+        return
+    pending: List[pa.RecordBatch] = []
+    rows = 0
+    yielded = False
+    for batch in reader:
+        pending.append(batch)
+        rows += batch.num_rows
+        while rows >= chunksize:
+            table = pa.Table.from_batches(pending, schema=reader.schema)
+            yield table.slice(0, chunksize).to_pandas(types_mapper=pd.ArrowDtype)
+            yielded = True
+            rest = table.slice(chunksize)
+            pending = rest.to_batches()
+            rows = rest.num_rows
+    if rows:
+        yield pa.Table.from_batches(pending, schema=reader.schema).to_pandas(types_mapper=pd.ArrowDtype)
+    elif not yielded:
+        yield reader.schema.empty_table().to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def _iter_text_frames(
+    reader: pa.RecordBatchReader, chunksize: int, source: Optional[IO[bytes]] = None
+) -> Iterator[pd.DataFrame]:
+    """Yield ``reader``'s rows in frames of ``chunksize`` rows (0 = one frame).
+
+    Always yields at least one frame, so a header-only CSV still produces a
+    header in the output. Arrow rejects rows with missing trailing fields,
+    which ``pd.read_csv`` pads with nulls; when that happens the rest of the
+    file is read with pandas from ``source``, the seekable handle ``reader``
+    was opened on, skipping the rows already yielded.
+    """
+
+    yielded = 0
+    try:
+        for frame in _iter_arrow_frames(reader, chunksize):
+            yield frame
+            yielded += len(frame)
+    except pa.ArrowInvalid as exc:
+        if not _is_short_row_error(exc):
+            raise
+        if source is None or not source.seekable():
+            raise ValueError(
+                f"{exc}. Rows with missing trailing fields can only be padded when reading from a file, not a pipe."
+            ) from exc
+        source.seek(0)
+        wanted = set(reader.schema.names)
+        frames = pd.read_csv(
+            source,
+            usecols=lambda c: c in wanted,
+            skiprows=range(1, yielded + 1),
+            dtype=pd.ArrowDtype(pa.string()),
+            keep_default_na=False,
+            na_values=pacsv.ConvertOptions().null_values,
+            chunksize=chunksize if chunksize > 0 else None,
+        )
+        if chunksize <= 0:
+            yield frames
+        else:
+            yield from frames
+
+
+def read_text_csv(source: IO[bytes], columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """Read a CSV with every column kept as text, the way the CLI reads opportunities.
+
+    ``columns`` limits the result to those headers (missing ones are ignored).
+    """
+
+    return next(_iter_text_frames(_open_text_csv(source, columns), 0, source))
+
+
+def _load_metrics(
+    path: str,
+    wanted_ids: Optional[Iterable],
+    channel_header: str = "channel_id",
+    use_cache: bool = False,
+) -> pd.DataFrame:
+    """Read the Tubular CSV, keeping only rows whose channel ID is in ``wanted_ids``.
+
+    The channel column is read as text to match the opportunities' keys. The
+    filter runs on the Arrow table so unwanted rows are never converted to
+    pandas. Without ``wanted_ids`` (or a channel column) every row is kept.
+    """
+
+    text_columns = [channel_header]
+    if use_cache and os.path.isfile(path):
+        table = _read_cached_table(path, text_columns)
+    else:
+        table = _read_table(path, text_columns)
+    if wanted_ids is not None and channel_header in table.column_names:
+        # merge_data strips key whitespace, so match on trimmed values here too.
+        keys = pc.utf8_trim_whitespace(table.column(channel_header))
+        value_set = pc.utf8_trim_whitespace(pa.array(list(wanted_ids), pa.string()))
+        table = table.filter(pc.is_in(keys, value_set=value_set))
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def write_merged(
+    merged: pd.DataFrame,
+    sink: Union[str, IO[str], pa.NativeFile],
+    file_format: str = "csv",
+    include_header: bool = True,
+) -> None:
+    """Serialize the merged frame as CSV (via ``to_csv``) or Parquet (via Arrow).
+
+    CSV keeps pandas' formatting so the output matches earlier exports, with
+    strings only quoted where needed. ``include_header`` only applies to CSV
+    and lets callers append batches to an open text sink.
+    """
+
+    if file_format == "parquet":
+        pq.write_table(pa.Table.from_pandas(merged, preserve_index=False), sink)
+    else:
+        merged.to_csv(sink, index=False, header=include_header)
+
+
+def _find_channel_column(columns: AbstractSet[str]) -> Optional[str]:
+    for col in CHANNEL_COLUMN_CANDIDATES:
+        if col in columns:
             return col
     return None
 
 
-def _select_account_column(opps: pd.DataFrame) -> Optional[str]:
-    for col in ["Account.Name", "account_name", "Account"]:
-        if col in opps.columns:
+def _select_account_column(columns: AbstractSet[str]) -> Optional[str]:
+    for col in ACCOUNT_COLUMN_CANDIDATES:
+        if col in columns:
             return col
     return None
 
 
+def _strip_keys(keys: pd.Series) -> Tuple[pd.Series, pd.Index]:
+    """Trim surrounding whitespace from string join keys.
+
+    Only the distinct values are stripped and then expanded back through the
+    factorized codes. Case is preserved because YouTube channel IDs are
+    case-sensitive. Also returns the stripped distinct non-null keys, so
+    callers don't hash the column again to find them.
+    """
+
+    codes, uniques = pd.factorize(keys)
+    uniques = pd.Index(uniques)
+    if not pd.api.types.is_string_dtype(uniques):
+        return keys, uniques
+    stripped = uniques.str.strip()
+    if stripped.equals(uniques):
+        return keys, uniques
+    return pd.Series(stripped.array.take(codes, allow_fill=True), index=keys.index, name=keys.name), stripped
+
+
+def _drop_duplicate_channels(metrics: pd.DataFrame, key: str = "channel_id") -> Tuple[pd.DataFrame, int]:
+    """Keep the first metrics row per channel so the left join cannot fan out.
+
+    Returns the deduplicated frame and the number of rows dropped.
+    """
+
+    if key not in metrics.columns:
+        return metrics, 0
+    deduped = metrics.drop_duplicates(subset=[key], keep="first")
+    return deduped, len(metrics) - len(deduped)
+
+
 def merge_data(
     opps_df: pd.DataFrame,
     metrics_df: pd.DataFrame,
     map_df: Optional[pd.DataFrame] = None,
-    metrics_colmap: Optional[Dict[str, str]] = None,
+    metrics_renames: Optional[Mapping[str, str]] = None,
+    columns: Optional[Sequence[str]] = None,
 ) -> pd.DataFrame:
-    """Merge Salesforce opportunities and Tubular metrics data frames."""
+    """Merge Salesforce opportunities and Tubular metrics data frames.
+
+    ``metrics_renames`` renames metrics headers (existing -> expected), as
+    returned by ``parse_metrics_renames``. ``columns`` optionally whitelists the
+    opportunity columns carried into the result; the channel key is always
+    kept. The input frames are treated as read-only: every step below builds a
+    new frame instead of assigning into them, so they are never copied up
+    front.
+    """
 
-    opps = opps_df.copy()
-    metrics = metrics_df.copy()
-    metrics_colmap = metrics_colmap or {}
+    opps = opps_df
+    metrics = metrics_df
+    opps_columns = set(opps.columns)
+    metrics_columns = set(metrics.columns)
 
-    channel_col = _find_channel_column(opps)
+    channel_col = _find_channel_column(opps_columns)
     map_used = False
 
     if channel_col is None:
@@ -82,44 +459,70 @@ def merge_data(
             raise ValueError(
                 "Opps CSV has no channel_id column. Provide a channel map with account_name and channel_id."
             )
-        cmap = map_df.copy()
+        cmap = map_df
         if "account_name" not in cmap.columns or "channel_id" not in cmap.columns:
             raise ValueError("channel_map.csv must include: account_name, channel_id")
-        acct_col = _select_account_column(opps)
+        acct_col = _select_account_column(opps_columns)
         if acct_col is None:
             raise ValueError("Couldn't find Account.Name column in opps to join with channel_map.")
-        opps = opps.merge(
-            cmap[["account_name", "channel_id"]],
-            left_on=acct_col,
-            right_on="account_name",
-            how="left",
-        )
+        # Built back to front so the first row for a duplicated account wins.
+        channel_lookup = dict(zip(cmap["account_name"].to_numpy()[::-1], cmap["channel_id"].to_numpy()[::-1]))
+        opps = opps.assign(channel_id=opps[acct_col].map(channel_lookup))
         channel_col = "channel_id"
         map_used = True
 
-    if metrics_colmap:
-        metrics = metrics.rename(columns={v: k for k, v in metrics_colmap.items()})
+    if columns is not None:
+        keep = set(columns)
+        opps = opps[[c for c in opps.columns if c in keep or c == channel_col]]
+
+    if metrics_renames:
+        renames = {old: new for old, new in metrics_renames.items() if old != new and old in metrics_columns}
+        if renames:
+            metrics = metrics.rename(columns=renames)
+            metrics_columns = set(metrics.columns)
 
-    if "channel_id" not in metrics.columns:
+    if "channel_id" not in metrics_columns:
         raise ValueError("Metrics CSV must include 'channel_id' (or map it via --metrics-cols).")
 
-    for c in ["views_30d", "audience_size", "category", "growth_30d_pct", "channel_name"]:
-        if c not in metrics.columns:
-            metrics[c] = None
-
-    merged = opps.merge(
-        metrics[[
-            "channel_id",
-            "channel_name",
-            "views_30d",
-            "audience_size",
-            "category",
-            "growth_30d_pct",
-        ]],
-        left_on=channel_col,
-        right_on="channel_id",
-        how="left",
-    )
+    opps_keys, wanted = _strip_keys(opps[channel_col])
+    metrics_keys, _ = _strip_keys(metrics["channel_id"])
+    opps = opps.assign(**{channel_col: opps_keys})
+    metrics = metrics.assign(channel_id=metrics_keys)
+    if len(wanted) and pd.api.types.is_string_dtype(wanted) != pd.api.types.is_string_dtype(metrics_keys):
+        raise ValueError(
+            f"Can't join opps column '{channel_col}' ({opps_keys.dtype}) with metrics 'channel_id' "
+            f"({metrics_keys.dtype}): only one of them holds text."
+        )
+    metrics = metrics[metrics["channel_id"].isin(wanted)]
+
+    missing = {
+        c: None
+        for c in ["views_30d", "audience_size", "category", "growth_30d_pct", "channel_name"]
+        if c not in metrics_columns
+    }
+    metrics, duplicate_channels = _drop_duplicate_channels(metrics)
+
+    metrics = metrics.assign(**missing)
+    metrics_by_channel = metrics.set_index("channel_id")[[
+        "channel_name",
+        "views_30d",
+        "audience_size",
+        "category",
+        "growth_30d_pct",
+    ]]
+    merged = opps.join(metrics_by_channel, on=channel_col, how="left", lsuffix="_x", rsuffix="_y")
+
+    # Counts fit in 32 bits for almost every channel; to_numeric only narrows
+    # when the values allow it, and non-numeric exports are left untouched.
+    # A metric the opps also carry comes back suffixed from the join, so its
+    # plain name may be missing here.
+    for c in ["views_30d", "audience_size"]:
+        if c in merged.columns and pd.api.types.is_numeric_dtype(merged[c]):
+            merged[c] = pd.to_numeric(merged[c], downcast="integer")
+    # NumPy float32 rather than Arrow's: to_csv writes Arrow float32 values at
+    # full binary precision (4.2 becomes 4.199999809265137).
+    if "growth_30d_pct" in merged.columns and pd.api.types.is_numeric_dtype(merged["growth_30d_pct"]):
+        merged["growth_30d_pct"] = merged["growth_30d_pct"].astype("float32")
 
     preferred = [
         "Account.Id",
@@ -137,11 +540,16 @@ def merge_data(
         "category",
         "growth_30d_pct",
     ]
-    cols = [c for c in preferred if c in merged.columns] + [c for c in merged.columns if c not in preferred]
+    preferred_set = set(preferred)
+    merged_columns = set(merged.columns)
+    cols = [c for c in preferred if c in merged_columns] + [c for c in merged.columns if c not in preferred_set]
+    # Plain selection rather than reindex: a --metrics-cols rename can leave
+    # duplicate labels, which reindex rejects.
     merged = merged[cols]
 
     merged.attrs["channel_column"] = channel_col
     merged.attrs["map_used"] = map_used
+    merged.attrs["duplicate_channels"] = duplicate_channels
 
     return merged
 
@@ -161,8 +569,25 @@ def main(argv=None):
     ap.add_argument("--opps", required=True)
     ap.add_argument("--metrics", required=True, help="Tubular CSV export")
     ap.add_argument("--map", required=False, help="Optional channel_map.csv to attach channel_id by Account.Name")
-    ap.add_argument("--out", required=True)
+    ap.add_argument("--out", required=True, help="Output path; a .parquet extension writes Parquet instead of CSV")
     ap.add_argument("--metrics-cols", required=False, default="", help="Header mapping new:old,new:old ...")
+    ap.add_argument(
+        "--opps-cols",
+        required=False,
+        default="",
+        help="Comma-separated opps columns to keep in the output (default: all)",
+    )
+    ap.add_argument(
+        "--chunksize",
+        type=int,
+        default=DEFAULT_CHUNKSIZE,
+        help=f"Opps rows merged and written per batch for CSV output; 0 loads the whole file (default: {DEFAULT_CHUNKSIZE})",
+    )
+    ap.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't read or write the Feather cache of parsed inputs (~/.cache/sf-tubular-merge)",
+    )
     argv = list(sys.argv[1:] if argv is None else argv)
     if not argv:
         ap.print_help()
@@ -170,19 +595,81 @@ def main(argv=None):
 
     args = ap.parse_args(argv)
 
-    opps = pd.read_csv(args.opps)
-    metrics = pd.read_csv(args.metrics)
-    cmap_df = pd.read_csv(args.map) if args.map else None
-
     try:
-        colmap = parse_colmap(args.metrics_cols)
-        merged = merge_data(opps, metrics, map_df=cmap_df, metrics_colmap=colmap)
+        renames = parse_metrics_renames(args.metrics_cols)
     except ValueError as exc:
         raise SystemExit(str(exc)) from exc
 
-    merged.to_csv(args.out, index=False)
-    channel_col = merged.attrs.get("channel_column", "channel_id")
-    print(f"Wrote {args.out} with {len(merged)} rows (joined on '{channel_col}').")
+    opps_columns = None
+    if args.opps_cols:
+        opps_columns = [c.strip() for c in args.opps_cols.split(",") if c.strip()]
+    # Key columns have to be parsed even when they are not part of the output.
+    read_columns = None
+    if opps_columns is not None:
+        read_columns = [*opps_columns, *CHANNEL_COLUMN_CANDIDATES, *ACCOUNT_COLUMN_CANDIDATES]
+    use_cache = not args.no_cache
+    # Opportunities are read as text, so the map's keys have to be text too.
+    cmap_df = read_csv(args.map, use_cache, ("account_name", "channel_id")) if args.map else None
+
+    opps_file = open(args.opps, "rb")
+    try:
+        reader = _open_text_csv(opps_file, read_columns)
+        channel_col = _find_channel_column(set(reader.schema.names))
+        # Only the channel key is parsed here, and only when the file can be
+        # read twice; a pipe is read once and the metrics stay unfiltered.
+        if channel_col is not None and os.path.isfile(args.opps):
+            with open(args.opps, "rb") as key_file:
+                wanted_ids = read_text_csv(key_file, [channel_col])[channel_col].dropna().unique()
+        elif channel_col is None and cmap_df is not None and "channel_id" in cmap_df.columns:
+            wanted_ids = cmap_df["channel_id"].dropna().unique()
+        else:
+            wanted_ids = None
+        channel_header = next((old for old, new in renames.items() if new == "channel_id"), "channel_id")
+        metrics = _load_metrics(args.metrics, wanted_ids, channel_header, use_cache)
+        # Rename and deduplicate once here rather than per batch; merge_data then
+        # has nothing left to do to the metrics frame before the join.
+        if renames:
+            metrics = metrics.rename(columns=renames)
+        if "channel_id" in metrics.columns:
+            metrics = metrics.assign(channel_id=_strip_keys(metrics["channel_id"])[0])
+        metrics, duplicate_channels = _drop_duplicate_channels(metrics)
+        if duplicate_channels:
+            print(
+                f"Warning: dropped {duplicate_channels} duplicate Tubular rows (kept the first row per channel_id).",
+                file=sys.stderr,
+            )
+
+        file_format = "parquet" if args.out.lower().endswith(".parquet") else "csv"
+        # Write next to --out and move the file into place once every batch
+        # has merged, so a failed run leaves an existing output untouched.
+        # Special files such as /dev/stdout are written to directly.
+        replace_out = os.path.isfile(args.out) or not os.path.exists(args.out)
+        write_path = f"{args.out}.{os.getpid()}.tmp" if replace_out else args.out
+        rows = 0
+        try:
+            if file_format == "parquet":
+                merged = merge_data(next(_iter_text_frames(reader, 0, opps_file)), metrics, map_df=cmap_df, columns=opps_columns)
+                write_merged(merged, write_path, file_format)
+                rows = len(merged)
+                channel_col = merged.attrs.get("channel_column", "channel_id")
+            else:
+                with open(write_path, "w", newline="") as sink:
+                    for i, chunk in enumerate(_iter_text_frames(reader, args.chunksize, opps_file)):
+                        merged = merge_data(chunk, metrics, map_df=cmap_df, columns=opps_columns)
+                        write_merged(merged, sink, include_header=i == 0)
+                        rows += len(merged)
+                        channel_col = merged.attrs.get("channel_column", "channel_id")
+            if replace_out:
+                os.replace(write_path, args.out)
+        except ValueError as exc:
+            raise SystemExit(str(exc)) from exc
+        finally:
+            if replace_out:
+                Path(write_path).unlink(missing_ok=True)
+    finally:
+        opps_file.close()
+
+    print(f"Wrote {args.out} with {rows} rows (joined on '{channel_col}').")
 
 
 if __name__ == "__main__":
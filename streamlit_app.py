@@ -1,21 +1,89 @@
 """Streamlit UI for merging Salesforce opportunities with Tubular metrics."""
-from typing import Optional, TYPE_CHECKING
+import io
+from typing import Optional, Sequence, TYPE_CHECKING
 
 import pandas as pd
+import pyarrow as pa
 import streamlit as st
 
-from merge_no_api import merge_data, parse_colmap
+from merge_no_api import merge_data, parse_metrics_renames, read_csv, read_text_csv, write_merged
 
 if TYPE_CHECKING:  # pragma: no cover - only for type hints when running tests/mypy
     from streamlit.runtime.uploaded_file_manager import UploadedFile
 
 
-def _read_uploaded_csv(file: "UploadedFile", label: str) -> Optional[pd.DataFrame]:
-    """Load a CSV from an uploaded file object, rewinding the buffer before reading."""
+@st.cache_data(max_entries=4, show_spinner=False)
+def _parse_csv_bytes(data: bytes, text_columns: Sequence[str], all_text: bool) -> pd.DataFrame:
+    """Parse uploaded CSV bytes, memoized on their content across reruns.
+
+    ``all_text`` keeps every column as text, the way the CLI reads
+    opportunities, so both write the same values; ``text_columns`` does that
+    for just the join keys. The options have no defaults because the cache
+    key only matches when every call spells them out the same way.
+    """
+
+    if all_text:
+        return read_text_csv(io.BytesIO(data))
+    return read_csv(io.BytesIO(data), text_columns=text_columns)
+
+
+MAP_TEXT_COLUMNS = ("account_name", "channel_id")
+
+
+def _metrics_text_columns(metrics_mapping: str) -> tuple:
+    """Headers that hold the Tubular channel key, read as text to match the opps keys."""
+
+    try:
+        renames = parse_metrics_renames(metrics_mapping)
+    except ValueError:
+        renames = {}
+    return ("channel_id", *(old for old, new in renames.items() if new == "channel_id"))
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _merge_uploads(
+    opps_data: bytes,
+    metrics_data: bytes,
+    map_data: Optional[bytes],
+    metrics_mapping: str,
+    columns: Optional[Sequence[str]] = None,
+    limit: Optional[int] = None,
+) -> pd.DataFrame:
+    """Merge the uploaded files, memoized on their content and the header mapping text.
+
+    ``limit`` merges only the first opportunities, which is all a preview needs.
+    """
+
+    opps_df = _parse_csv_bytes(opps_data, (), True)
+    if limit is not None:
+        opps_df = opps_df.head(limit)
+    map_df = _parse_csv_bytes(map_data, MAP_TEXT_COLUMNS, False) if map_data is not None else None
+    return merge_data(
+        opps_df,
+        _parse_csv_bytes(metrics_data, _metrics_text_columns(metrics_mapping), False),
+        map_df=map_df,
+        metrics_renames=parse_metrics_renames(metrics_mapping),
+        columns=columns,
+    )
+
+
+def _serialize_merged(merged: pd.DataFrame, file_format: str) -> bytes:
+    """Write the merged frame to an in-memory buffer in the chosen format."""
+
+    if file_format == "csv":
+        return merged.to_csv(index=False).encode("utf-8")
+    buffer = pa.BufferOutputStream()
+    write_merged(merged, buffer, file_format)
+    return buffer.getvalue().to_pybytes()
+
+
+def _read_uploaded_csv(
+    file: "UploadedFile", label: str, text_columns: Sequence[str] = (), all_text: bool = False
+) -> Optional[pd.DataFrame]:
+    """Load a CSV from an uploaded file object via the cached parser."""
 
     try:
-        file.seek(0)
-        return pd.read_csv(file)
+        return _parse_csv_bytes(file.getvalue(), text_columns, all_text)
     except pd.errors.EmptyDataError:
         st.error(f"{label} appears to be empty. Upload a CSV with data.")
     except Exception as exc:  # pragma: no cover - defensive logging for unexpected errors
@@ -58,37 +126,53 @@ metrics_mapping = st.text_input(
 
 preview_toggle = st.checkbox("Show input previews", value=False)
 
+output_format = st.radio(
+    "Download format",
+    options=["CSV", "Parquet"],
+    horizontal=True,
+    help="Parquet files are much smaller and load faster in pandas, Spark and BI tools.",
+)
+
 opps_df: Optional[pd.DataFrame] = None
 map_df: Optional[pd.DataFrame] = None
 metrics_df: Optional[pd.DataFrame] = None
-colmap = None
+metrics_renames = None
 
 if opps_file is not None:
-    opps_df = _read_uploaded_csv(opps_file, "Salesforce opportunities CSV")
+    opps_df = _read_uploaded_csv(opps_file, "Salesforce opportunities CSV", all_text=True)
     if preview_toggle and opps_df is not None:
         st.caption("Opportunities preview")
         st.dataframe(opps_df.head())
 
 if map_file is not None:
-    map_df = _read_uploaded_csv(map_file, "Channel map CSV")
+    map_df = _read_uploaded_csv(map_file, "Channel map CSV", MAP_TEXT_COLUMNS)
     if preview_toggle and map_df is not None:
         st.caption("Channel map preview")
         st.dataframe(map_df.head())
 
 if metrics_file is not None:
-    metrics_df = _read_uploaded_csv(metrics_file, "Tubular metrics CSV")
+    metrics_df = _read_uploaded_csv(metrics_file, "Tubular metrics CSV", _metrics_text_columns(metrics_mapping))
     if preview_toggle and metrics_df is not None:
         st.caption("Tubular metrics preview")
         st.dataframe(metrics_df.head())
 
 if metrics_mapping:
     try:
-        colmap = parse_colmap(metrics_mapping)
+        metrics_renames = parse_metrics_renames(metrics_mapping)
     except ValueError as exc:
         st.error(str(exc))
-        colmap = None
+        metrics_renames = None
+
+opps_columns: Optional[tuple] = None
+if opps_df is not None:
+    selected_columns = st.multiselect(
+        "Opportunity columns to keep (optional)",
+        options=list(opps_df.columns),
+        help="Leave empty to keep every column. The channel ID column is always kept.",
+    )
+    opps_columns = tuple(selected_columns) or None
 
-merge_button_disabled = opps_df is None or metrics_df is None or (metrics_mapping and colmap is None)
+merge_button_disabled = opps_df is None or metrics_df is None or (bool(metrics_mapping) and metrics_renames is None)
 
 merge_clicked = st.button("Merge data", disabled=merge_button_disabled)
 
@@ -96,30 +180,52 @@ if merge_clicked:
     if opps_df is None or metrics_df is None:
         st.error("Upload both the Salesforce opportunities file and the Tubular metrics file.")
     else:
+        upload_args = (
+            opps_file.getvalue(),
+            metrics_file.getvalue(),
+            map_file.getvalue() if map_df is not None else None,
+            metrics_mapping,
+        )
         try:
-            merged = merge_data(opps_df, metrics_df, map_df=map_df, metrics_colmap=colmap)
+            # Only the channel key is carried through, which is enough for the
+            # match statistics; the full-width merge is left to the preview
+            # slice and the download.
+            summary = _merge_uploads(*upload_args, columns=())
         except ValueError as exc:
             st.error(str(exc))
         else:
             st.success(
-                f"Merged {len(merged)} opportunities using channel column "
-                f"`{merged.attrs.get('channel_column', 'channel_id')}`."
+                f"Merged {len(summary)} opportunities using channel column "
+                f"`{summary.attrs.get('channel_column', 'channel_id')}`."
             )
 
-            metrics_missing = merged["channel_name"].isna().sum() if "channel_name" in merged.columns else 0
-            map_used = merged.attrs.get("map_used", False)
+            duplicate_channels = summary.attrs.get("duplicate_channels", 0)
+            if duplicate_channels:
+                st.warning(
+                    f"Dropped {duplicate_channels} duplicate Tubular rows "
+                    "(kept the first row per channel_id)."
+                )
+
+            metrics_missing = summary["channel_name"].isna().sum() if "channel_name" in summary.columns else 0
+            map_used = summary.attrs.get("map_used", False)
 
             info_cols = st.columns(3)
-            info_cols[0].metric("Total rows", len(merged))
+            info_cols[0].metric("Total rows", len(summary))
             info_cols[1].metric("Missing Tubular matches", metrics_missing)
             info_cols[2].metric("Used channel map", "Yes" if map_used else "No")
 
-            st.dataframe(merged.head(100))
+            st.dataframe(_merge_uploads(*upload_args, columns=opps_columns, limit=100))
+
+            file_format = output_format.lower()
+
+            def _download_bytes() -> bytes:
+                # Memoized like the summary and preview, so a repeat click skips the merge.
+                return _serialize_merged(_merge_uploads(*upload_args, columns=opps_columns), file_format)
 
-            csv_bytes = merged.to_csv(index=False).encode("utf-8")
             st.download_button(
-                "Download merged CSV",
-                data=csv_bytes,
-                file_name="merged.csv",
-                mime="text/csv",
+                f"Download merged {output_format}",
+                # The full merge and serialization run only when the button is clicked.
+                data=_download_bytes,
+                file_name=f"merged.{file_format}",
+                mime="text/csv" if file_format == "csv" else "application/vnd.apache.parquet",
             )